@@ -1,23 +1,40 @@
 import logging
 import os
 
+_FORMATTER = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
+
+def _base_logger() -> logging.Logger:
+    # Parent of every per-run logger; the console handler is attached only once
+    base = logging.getLogger("etl")
+    if not base.handlers:
+        sh = logging.StreamHandler()
+        sh.setFormatter(_FORMATTER)
+        base.addHandler(sh)
+    return base
+
 def get_logger(run_id: str, logs_dir: str = "logs"):
-    os.makedirs(logs_dir, exist_ok=True)
     log_path = os.path.join(logs_dir, f"etl_{run_id}.log")
 
+    _base_logger()
     logger = logging.getLogger(f"etl.{run_id}")
     logger.setLevel(logging.INFO)
-    logger.handlers.clear()
-
-    fmt = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
 
-    fh = logging.FileHandler(log_path, encoding="utf-8")
-    fh.setFormatter(fmt)
-    logger.addHandler(fh)
-
-    sh = logging.StreamHandler()
-    sh.setFormatter(fmt)
-    logger.addHandler(sh)
+    if not logger.handlers:
+        try:
+            fh = logging.FileHandler(log_path, encoding="utf-8")
+        except FileNotFoundError:
+            # logs_dir is created at startup; recreate it if it was removed since
+            os.makedirs(logs_dir, exist_ok=True)
+            fh = logging.FileHandler(log_path, encoding="utf-8")
+        fh.setFormatter(_FORMATTER)
+        logger.addHandler(fh)
 
     logger.info(f"Log initialized at {log_path}")
     return logger, log_path
+
+def close_logger(logger: logging.Logger):
+    """Detach and close the per-run file handler once the run is finished."""
+    handlers = logger.handlers[:]
+    logger.handlers[:] = []
+    for h in handlers:
+        h.close()
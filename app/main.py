@@ -1,39 +1,263 @@
+import io
 import os
-import json
 import time
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-from .logger import get_logger
-from .reader import read_parquet_file
-from .transformer import apply_transformations
-from .writer import write_output
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple, Union
+import aiofiles
+import orjson
+import polars as pl
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi.responses import ORJSONResponse
+from .logger import get_logger, close_logger
+from .reader import read_parquet_file, count_rows
+from .transformer import apply_transformations, compile_mappings, CompiledMappings
+from .writer import write_output, count_written_rows, SINK_FORMATS
 from .exceptions import ETLError, MappingError, TransformError, ValidationError, WriterError
-from .utils import timestamp_run_id
+from .utils import timestamp_run_id, ensure_dir
 
 app = FastAPI(
     title="ETL Engine (FastAPI + Polars)", 
     version="1.0.0",
     description="A high-performance ETL engine built with FastAPI and Polars",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
 BASE_OUTPUT_DIR = os.environ.get("ETL_OUTPUT_DIR", "output")
 BASE_LOGS_DIR = os.environ.get("ETL_LOGS_DIR", "logs")
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+# Rows per batch in Polars' streaming engine; bounds memory for larger-than-RAM inputs
+STREAMING_CHUNK_SIZE = int(os.environ.get("POLARS_STREAMING_CHUNK", "100000"))
+# Uploads are handed to Polars from memory unless persisting is requested or they are too large
+PERSIST_INPUTS = os.environ.get("ETL_PERSIST_INPUTS", "0").lower() in ("1", "true")
+IN_MEMORY_MAX_BYTES = int(os.environ.get("ETL_IN_MEMORY_MAX_BYTES", str(512 << 20)))  # 512 MiB
+SUPPORTED_OUTPUT_FORMATS = ["csv", "json", "json_array", "xlsx", "xml", "positional"]
+
+# LRU cache of parsed mapping configs and their compiled expressions,
+# keyed by "<mapping content hash>:<input schema hash>"
+MAPPING_CACHE_SIZE = 128
+_MAPPING_CACHE: "OrderedDict[str, Tuple[Dict[str, Any], CompiledMappings]]" = OrderedDict()
+_MAPPING_CACHE_LOCK = threading.Lock()
+
+# Runs read/transform/write off the event loop, one worker per concurrent run.
+# All runs share Polars' process-wide thread pool (sized by POLARS_MAX_THREADS).
+MAX_CONCURRENT_RUNS = max(1, int(os.environ.get("ETL_MAX_CONCURRENT_RUNS", "4")))
+_ETL_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_RUNS, thread_name_prefix="etl")
+
+# Outcome of runs submitted with async_write=true, most recent last
+RUN_STATUS_HISTORY = 1024
+_RUN_STATUS: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+def _mapping_cache_get(key: str) -> Optional[Tuple[Dict[str, Any], CompiledMappings]]:
+    with _MAPPING_CACHE_LOCK:
+        entry = _MAPPING_CACHE.get(key)
+        if entry is not None:
+            _MAPPING_CACHE.move_to_end(key)
+        return entry
+
+def _mapping_cache_put(key: str, entry: Tuple[Dict[str, Any], CompiledMappings]) -> None:
+    with _MAPPING_CACHE_LOCK:
+        _MAPPING_CACHE[key] = entry
+        _MAPPING_CACHE.move_to_end(key)
+        while len(_MAPPING_CACHE) > MAPPING_CACHE_SIZE:
+            _MAPPING_CACHE.popitem(last=False)
+
+def _load_mapping_config(mapping_bytes: bytes) -> Dict[str, Any]:
+    """Parse and validate a mapping configuration."""
+    try:
+        mapping_cfg = orjson.loads(mapping_bytes)
+    except orjson.JSONDecodeError as e:
+        raise MappingError(f"Invalid JSON in mapping file: {e}")
+    except Exception as e:
+        raise MappingError(f"Failed to read mapping file: {e}")
+    
+    # Validate mapping configuration
+    if not isinstance(mapping_cfg, dict):
+        raise MappingError("Mapping configuration must be a JSON object")
+    
+    output_format = mapping_cfg.get("output_format", "csv").lower()
+    if output_format not in SUPPORTED_OUTPUT_FORMATS:
+        raise MappingError(f"Unsupported output format: {output_format}")
+
+    # Validate mappings
+    mappings = mapping_cfg.get("mappings", [])
+    if not isinstance(mappings, list):
+        raise MappingError("'mappings' must be a list")
+    if not mappings:
+        raise MappingError("No 'mappings' found in mapping.json")
+    return mapping_cfg
+
+async def _save_upload(upload: UploadFile, path: str) -> None:
+    """Stream an uploaded file to disk in fixed-size chunks."""
+    async with aiofiles.open(path, "wb") as f:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+
+def _do_transform(run_id: str, parquet_source: Union[str, io.BytesIO], mapping_bytes: bytes, logger: logging.Logger) -> Dict[str, Any]:
+    """Read and transform one run. CPU-bound, so it runs on the ETL executor."""
+    # Read and validate parquet file (a saved path or the in-memory upload)
+    read_start = time.perf_counter_ns()
+    lf = read_parquet_file(parquet_source)
+    if isinstance(parquet_source, io.BytesIO):
+        # The decoded frame owns its data now; drop the upload buffer before transforming
+        parquet_source.close()
+    # Resolve the schema once; it feeds the log line, the cache key and expression building
+    schema = lf.collect_schema()
+    input_rows = count_rows(lf)
+    if input_rows == 0:
+        logger.warning("Input parquet file is empty")
+    read_time = (time.perf_counter_ns() - read_start) / 1e6
+    source_desc = parquet_source if isinstance(parquet_source, str) else "in-memory upload"
+    logger.info(f"Scanned parquet: {source_desc} | rows={input_rows}, cols={len(schema)} | time={read_time:.2f}ms")
+
+    # Load and validate mapping configuration, reusing cached configs
+    mapping_load_start = time.perf_counter_ns()
+    # Compiled expressions depend on the input schema as well as the mapping
+    mapping_hash = hashlib.blake2b(mapping_bytes, digest_size=16).hexdigest()
+    schema_hash = hashlib.blake2b(repr(list(schema.items())).encode("utf-8"), digest_size=16).hexdigest()
+    cache_key = f"{mapping_hash}:{schema_hash}"
+    cached = _mapping_cache_get(cache_key)
+    if cached is not None:
+        mapping_cfg, compiled = cached
+        logger.info("Mapping cache hit")
+    else:
+        mapping_cfg = _load_mapping_config(mapping_bytes)
+        compiled = None
+    mappings = mapping_cfg["mappings"]
+    
+    output_format = mapping_cfg.get("output_format", "csv").lower()
+    xml_cfg = mapping_cfg.get("xml_config", {})
+    output_base = mapping_cfg.get("output_path") or os.path.join(BASE_OUTPUT_DIR, "output")
+    base_with_ts = f"{output_base}_{run_id}"
+    
+    mapping_load_time = (time.perf_counter_ns() - mapping_load_start) / 1e6
+    logger.info(f"Mapping loaded and validated in {mapping_load_time:.2f}ms")
+
+    # Apply transformations
+    try:
+        transform_start = time.perf_counter_ns()
+        if compiled is None:
+            compiled = compile_mappings(lf, mappings, schema=schema)
+            # CURRENT_DATE is resolved at build time, so those mappings are never cached
+            if b"CURRENT_DATE" not in mapping_bytes.upper():
+                _mapping_cache_put(cache_key, (mapping_cfg, compiled))
+        # CSV/NDJSON outputs are streamed straight from the lazy plan to disk
+        stream_output = output_format in SINK_FORMATS
+        transformed = apply_transformations(lf, mappings, compiled=compiled, lazy=stream_output)
+        transform_time = (time.perf_counter_ns() - transform_start) / 1e6
+        if stream_output:
+            logger.info(f"Transform planned | streaming to {output_format} | time={transform_time:.2f}ms")
+        else:
+            logger.info(f"Transform complete | rows={transformed.height}, cols={transformed.width} | time={transform_time:.2f}ms")
+    except Exception as e:
+        logger.error(f"Transformation failed: {e}")
+        raise TransformError(f"Failed to apply transformations: {e}")
+
+    return {
+        "run_id": run_id,
+        "transformed": transformed,
+        "input_rows": input_rows,
+        "output_format": output_format,
+        "mappings": mappings,
+        "xml_cfg": xml_cfg,
+        "base_with_ts": base_with_ts,
+    }
+
+def _do_write(run: Dict[str, Any], logger: logging.Logger, start_time: int) -> Dict[str, Any]:
+    """Write a transformed run and build its result summary. Runs on the ETL executor."""
+    transformed = run["transformed"]
+    input_rows = run["input_rows"]
+
+    # Write output
+    try:
+        write_start = time.perf_counter_ns()
+        output_path = write_output(transformed, run["base_with_ts"], run["output_format"], run["mappings"], run["xml_cfg"], logger=logger)
+        write_time = (time.perf_counter_ns() - write_start) / 1e6
+        logger.info(f"Wrote output: {output_path} | time={write_time:.2f}ms")
+    except Exception as e:
+        logger.error(f"Failed to write output: {e}")
+        raise WriterError(f"Failed to write output: {e}")
+
+    # Calculate total time and performance metrics
+    total_time = (time.perf_counter_ns() - start_time) / 1e6
+    if isinstance(transformed, pl.LazyFrame):
+        output_rows = count_written_rows(output_path, run["output_format"])
+    else:
+        output_rows = transformed.height
+    throughput = input_rows / (total_time / 1000) if total_time > 0 else 0
+    
+    logger.info(f"ETL completed successfully in {total_time:.2f}ms")
+    logger.info(f"Performance: {throughput:,.0f} rows/second")
+    if input_rows:
+        logger.info(f"Data reduction: {input_rows:,} → {output_rows:,} rows ({((input_rows-output_rows)/input_rows*100):.1f}% reduction)")
+    
+    return {
+        "status": "success",
+        "run_id": run["run_id"],
+        "input_rows": input_rows,
+        "output_rows": output_rows,
+        "processing_time_ms": round(total_time, 2),
+        "throughput_rows_per_sec": round(throughput, 0),
+        "output_path": output_path
+    }
+
+def _set_run_status(run_id: str, status: Dict[str, Any]) -> None:
+    _RUN_STATUS[run_id] = status
+    _RUN_STATUS.move_to_end(run_id)
+    while len(_RUN_STATUS) > RUN_STATUS_HISTORY:
+        _RUN_STATUS.popitem(last=False)
+
+async def _write_in_background(run: Dict[str, Any], logger: logging.Logger, start_time: int) -> None:
+    """Write a run's output after the response has been sent and record the outcome."""
+    run_id = run["run_id"]
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(_ETL_EXECUTOR, _do_write, run, logger, start_time)
+        _set_run_status(run_id, result)
+    except Exception as e:
+        logger.error(f"ETL failed: {e}")
+        _set_run_status(run_id, {"status": "failed", "run_id": run_id, "error": str(e)})
+    finally:
+        close_logger(logger)
+
 @app.on_event("startup")
 async def startup_event():
-    """Ensure required directories exist on startup."""
-    os.makedirs(BASE_OUTPUT_DIR, exist_ok=True)
-    os.makedirs(BASE_LOGS_DIR, exist_ok=True)
+    """Ensure required directories exist and configure Polars' streaming engine."""
+    ensure_dir(BASE_OUTPUT_DIR)
+    ensure_dir(BASE_LOGS_DIR)
+    pl.Config.set_streaming_chunk_size(STREAMING_CHUNK_SIZE)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop accepting work on the ETL executor."""
+    _ETL_EXECUTOR.shutdown(wait=False)
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint to verify the service is running."""
     return {"status": "healthy", "service": "ETL Engine", "version": "1.0.0"}
 
+@app.get("/status/{run_id}")
+async def run_status(run_id: str):
+    """Report the status of a run submitted with async_write=true."""
+    status = _RUN_STATUS.get(run_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown run_id: {run_id}")
+    return status
+
 @app.post("/transform")
-async def transform_endpoint(parquet_file: UploadFile = File(...), mapping_file: UploadFile = File(...)):
+async def transform_endpoint(
+    background_tasks: BackgroundTasks,
+    parquet_file: UploadFile = File(...),
+    mapping_file: UploadFile = File(...),
+    async_write: bool = False,
+):
     # Input validation
     if not parquet_file.filename or not parquet_file.filename.endswith('.parquet'):
         raise HTTPException(status_code=400, detail="Invalid parquet file. Please upload a .parquet file.")
@@ -45,103 +269,50 @@ async def transform_endpoint(parquet_file: UploadFile = File(...), mapping_file:
     logger, log_path = get_logger(run_id, logs_dir=BASE_LOGS_DIR)
     
     # Start timing
-    start_time = time.time()
+    start_time = time.perf_counter_ns()
     logger.info("ETL run started")
     
     run_dir = os.path.join(BASE_OUTPUT_DIR, f"run_{run_id}")
-    os.makedirs(run_dir, exist_ok=True)
     parquet_path = os.path.join(run_dir, parquet_file.filename or "input.parquet")
     mapping_path = os.path.join(run_dir, mapping_file.filename or "mapping.json")
+    # The background writer closes the logger itself when async_write is used
+    close_logger_on_exit = True
 
     try:
-        # Save uploaded files
-        file_save_start = time.time()
-        with open(parquet_path, "wb") as f:
-            f.write(await parquet_file.read())
-        with open(mapping_path, "wb") as f:
-            f.write(await mapping_file.read())
-        file_save_time = (time.time() - file_save_start) * 1000
-        logger.info(f"Files saved in {file_save_time:.2f}ms")
-
-        # Load and validate mapping configuration
-        mapping_load_start = time.time()
-        try:
-            with open(mapping_path, "r", encoding="utf-8") as f:
-                mapping_cfg = json.load(f)
-        except json.JSONDecodeError as e:
-            raise MappingError(f"Invalid JSON in mapping file: {e}")
-        except Exception as e:
-            raise MappingError(f"Failed to read mapping file: {e}")
-        
-        # Validate mapping configuration
-        if not isinstance(mapping_cfg, dict):
-            raise MappingError("Mapping configuration must be a JSON object")
-        
-        output_format = mapping_cfg.get("output_format", "csv").lower()
-        if output_format not in ["csv", "json", "json_array", "xlsx", "xml", "positional"]:
-            raise MappingError(f"Unsupported output format: {output_format}")
-        
-        xml_cfg = mapping_cfg.get("xml_config", {})
-        output_base = mapping_cfg.get("output_path") or os.path.join(BASE_OUTPUT_DIR, "output")
-        base_with_ts = f"{output_base}_{run_id}"
-        
-        mapping_load_time = (time.time() - mapping_load_start) * 1000
-        logger.info(f"Mapping loaded and validated in {mapping_load_time:.2f}ms")
-
-        # Read and validate parquet file
-        read_start = time.time()
-        df = read_parquet_file(parquet_path)
-        if df.height == 0:
-            logger.warning("Input parquet file is empty")
-        read_time = (time.time() - read_start) * 1000
-        logger.info(f"Read parquet: {parquet_path} | rows={df.height}, cols={df.width} | time={read_time:.2f}ms")
-
-        # Validate mappings
-        mappings = mapping_cfg.get("mappings", [])
-        if not isinstance(mappings, list):
-            raise MappingError("'mappings' must be a list")
-        if not mappings:
-            raise MappingError("No 'mappings' found in mapping.json")
-
-        # Apply transformations
-        try:
-            transform_start = time.time()
-            transformed = apply_transformations(df, mappings)
-            transform_time = (time.time() - transform_start) * 1000
-            logger.info(f"Transform complete | rows={transformed.height}, cols={transformed.width} | time={transform_time:.2f}ms")
-        except Exception as e:
-            logger.error(f"Transformation failed: {e}")
-            raise TransformError(f"Failed to apply transformations: {e}")
+        # Receive uploaded files; inputs only go through disk when they must
+        file_save_start = time.perf_counter_ns()
+        persist_parquet = PERSIST_INPUTS or parquet_file.size is None or parquet_file.size > IN_MEMORY_MAX_BYTES
+        if persist_parquet:
+            # Run dirs are unique per run, so they bypass the ensure_dir cache
+            os.makedirs(run_dir, exist_ok=True)
+            await _save_upload(parquet_file, parquet_path)
+            parquet_source = parquet_path
+        else:
+            parquet_source = io.BytesIO(await parquet_file.read())
+        # Mapping files are small and their bytes are needed for the cache key
+        mapping_bytes = await mapping_file.read()
+        # Release the uploads' spooled temp files now rather than when the request ends
+        await parquet_file.close()
+        await mapping_file.close()
+        if PERSIST_INPUTS:
+            async with aiofiles.open(mapping_path, "wb") as f:
+                await f.write(mapping_bytes)
+        file_save_time = (time.perf_counter_ns() - file_save_start) / 1e6
+        logger.info(f"Files received in {file_save_time:.2f}ms (persisted to disk: {persist_parquet})")
 
-        # Write output
-        try:
-            write_start = time.time()
-            output_path = write_output(transformed, base_with_ts, output_format, xml_cfg)
-            write_time = (time.time() - write_start) * 1000
-            logger.info(f"Wrote output: {output_path} | time={write_time:.2f}ms")
-        except Exception as e:
-            logger.error(f"Failed to write output: {e}")
-            raise WriterError(f"Failed to write output: {e}")
-
-        # Calculate total time and performance metrics
-        total_time = (time.time() - start_time) * 1000
-        input_rows = df.height
-        output_rows = transformed.height
-        throughput = input_rows / (total_time / 1000) if total_time > 0 else 0
-        
-        logger.info(f"ETL completed successfully in {total_time:.2f}ms")
-        logger.info(f"Performance: {throughput:,.0f} rows/second")
-        logger.info(f"Data reduction: {input_rows:,} → {output_rows:,} rows ({((input_rows-output_rows)/input_rows*100):.1f}% reduction)")
-        
-        return {
-            "status": "success",
-            "run_id": run_id,
-            "input_rows": input_rows,
-            "output_rows": output_rows,
-            "processing_time_ms": round(total_time, 2),
-            "throughput_rows_per_sec": round(throughput, 0),
-            "output_path": output_path
-        }
+        # Read/transform/write are CPU-bound; keep them off the event loop
+        loop = asyncio.get_running_loop()
+        run = await loop.run_in_executor(_ETL_EXECUTOR, _do_transform, run_id, parquet_source, mapping_bytes, logger)
+        del parquet_source
+
+        if async_write:
+            # Respond now; the output is written after the response is sent
+            _set_run_status(run_id, {"status": "pending", "run_id": run_id, "output_path_pending": run["base_with_ts"]})
+            background_tasks.add_task(_write_in_background, run, logger, start_time)
+            close_logger_on_exit = False
+            return {"status": "accepted", "run_id": run_id, "output_path_pending": run["base_with_ts"]}
+
+        return await loop.run_in_executor(_ETL_EXECUTOR, _do_write, run, logger, start_time)
     except (MappingError, TransformError, ValidationError, WriterError, ETLError) as e:
         logger.error(f"ETL failed: {e}")
         # Clean up temporary files on error
@@ -164,3 +335,6 @@ async def transform_endpoint(parquet_file: UploadFile = File(...), mapping_file:
         except Exception as cleanup_error:
             logger.warning(f"Failed to cleanup temporary files: {cleanup_error}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
+    finally:
+        if close_logger_on_exit:
+            close_logger(logger)
@@ -1,12 +1,32 @@
+import io
 import os
 import polars as pl
+from typing import Union
 from .exceptions import ETLError
 
-def read_parquet_file(file_path: str) -> pl.DataFrame:
+def read_parquet_file(file_path: Union[str, bytes, io.BytesIO]) -> pl.LazyFrame:
+    """
+    Lazily scan a parquet file.
+
+    Only the columns and row groups needed by the final query are read, once
+    Polars applies projection and predicate pushdown at collect time. In-memory
+    uploads (bytes/BytesIO) are decoded directly without a round-trip to disk.
+    """
+    if isinstance(file_path, (bytes, io.BytesIO)):
+        try:
+            return pl.read_parquet(file_path).lazy()
+        except Exception as e:
+            raise ETLError(f"Failed to read parquet: {e}") from e
     if not os.path.exists(file_path):
         raise ETLError(f"Input parquet file not found: {file_path}")
     try:
-        df = pl.read_parquet(file_path)
-        return df
+        lf = pl.scan_parquet(file_path, low_memory=True)
+        # Resolve the schema from the footer now so unreadable files fail here
+        lf.collect_schema()
+        return lf
     except Exception as e:
         raise ETLError(f"Failed to read parquet: {e}") from e
+
+def count_rows(lf: pl.LazyFrame) -> int:
+    """Count rows of a lazy query; for a bare parquet scan this only reads metadata."""
+    return lf.select(pl.len()).collect().item()
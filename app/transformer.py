@@ -1,233 +1,230 @@
-import re
+import os
+import time
+import logging
 import polars as pl
-from typing import Any, Dict, List, Tuple, Optional
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple, Optional, Union
 from .exceptions import MappingError, TransformError, ValidationError
-from .utils import parse_transform_expression, coerce_simple_transform, parse_boolean_expr
+from .utils import parse_transform_expression, coerce_simple_transform, parse_boolean_expr, has_trns_prefix, is_multi_source_transform
 
-def _build_expr_for_mapping(df: pl.DataFrame, mapping: Dict[str, Any]) -> Optional[pl.Expr]:
-    # Handle both old format (target) and new format (affected_target)
-    target = mapping.get("target") or mapping.get("affected_target")
+logger = logging.getLogger(__name__)
+
+# Per-mapping build timing is noise at production scale; enable it for profiling only
+ENABLE_MAPPING_PROFILING = os.environ.get("ETL_MAPPING_PROFILING", "false").lower() == "true"
+
+# A compiled FILTER/FILTERS step: ("filter", predicate), ("head", n) or ("slice", offset)
+FilterStep = Tuple[str, Any]
+# Output of compile_mappings: (select expressions, filter steps)
+CompiledMappings = Tuple[List[pl.Expr], List[FilterStep]]
+
+@dataclass(slots=True)
+class NormalizedMapping:
+    """A mapping entry with its old/new format keys resolved once."""
+    target: str
+    sources: Tuple[str, ...]
+    transform: Optional[str]
+    default: Any
+
+def normalize_mapping(mapping: Dict[str, Any]) -> NormalizedMapping:
     # Handle both old format (source) and new format (affected_source)
     source = mapping.get("source") or mapping.get("affected_source")
-    # Handle both old format (transform) and new format (trns)
-    transform = mapping.get("transform") or mapping.get("trns")
-    default = mapping.get("default")
+    return NormalizedMapping(
+        # New format (affected_target) takes precedence, as it names the output column
+        target=mapping.get("affected_target", mapping.get("target", "no_target")),
+        # Handle comma-separated source fields
+        sources=tuple(col.strip() for col in source.split(',')) if source is not None else (),
+        # Handle both old format (transform) and new format (trns)
+        transform=mapping.get("transform") or mapping.get("trns"),
+        default=mapping.get("default"),
+    )
 
-    # Add logging for debugging
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    logger.info(f"Building expression for mapping: {mapping.get('id', 'no_id')}")
-    logger.info(f"  Target: {target}")
-    logger.info(f"  Source: {source}")
-    logger.info(f"  Transform: {transform}")
-    logger.info(f"  Default: {default}")
+def _build_expr_for_mapping(schema: pl.Schema, mapping: NormalizedMapping) -> Union[pl.Expr, Tuple[str, str, Tuple[str, ...]]]:
+    """Build the projection for a mapping, or return the parsed filter tuple for FILTER/FILTERS mappings."""
+    target = mapping.target
+    transform = mapping.transform
+    default = mapping.default
+    source_exprs: List[pl.Expr] = []
 
-    if source is not None:
-        # Handle comma-separated source fields
-        source_columns = [col.strip() for col in source.split(',')]
-        missing_columns = [col for col in source_columns if col not in df.columns]
+    if mapping.sources:
+        missing_columns = [col for col in mapping.sources if col not in schema]
+        if missing_columns and default is None:
+            logger.error(f"  Missing columns: {missing_columns}")
+            raise MappingError(f"Source column(s) {missing_columns} not found and no default provided.")
 
-        if missing_columns:
-            if default is not None:
-                src_expr = pl.lit(default)
-                logger.info(f"  Using default value: {default}")
-            else:
-                logger.error(f"  Missing columns: {missing_columns}")
-                raise MappingError(f"Source column(s) {missing_columns} not found and no default provided.")
-        else:
-            # Use the first source column for the source expression (for backward compatibility)
-            src_expr = pl.col(source_columns[0])
-            logger.info(f"  Using source column: {source_columns[0]}")
+        present = [col for col in mapping.sources if col in schema]
+        source_exprs = [pl.col(col) for col in present]
+        if isinstance(default, str) and any(schema[col] != pl.Utf8 for col in present):
+            # pl.coalesce promotes to the common supertype, so a string default turns the column into String
+            logger.warning(f"  String default {default!r} for target '{target}' makes the output column String (source dtypes: {[str(schema[col]) for col in present]})")
+        # First non-null value across the source columns, then the default;
+        # this covers both missing columns and null values in one vectorized expression
+        fallback = source_exprs + ([pl.lit(default)] if default is not None else [])
+        src_expr = fallback[0] if len(fallback) == 1 else pl.coalesce(fallback)
     else:
         if default is not None and transform is None:
-            logger.info(f"  Using default value (no transform): {default}")
             return pl.lit(default)
         src_expr = pl.lit(None)
-        logger.info(f"  No source, using None")
 
     if transform:
         try:
-            logger.info(f"  Applying transform: {transform}")
-            if transform.strip().lower().startswith("trns:"):
-                expr = parse_transform_expression(transform)
-                logger.info(f"  Parsed expression: {expr}")
-                if isinstance(expr, tuple) and expr[0] in ["FILTERS", "FILTER"]:
-                    return None
-                return expr
+            if has_trns_prefix(transform.strip()):
+                return parse_transform_expression(transform)
+            elif len(source_exprs) > 1 and is_multi_source_transform(transform):
+                # Multi-source transforms (concat/coalesce) receive every source column;
+                # the default then fills rows where the combined result is null
+                out = coerce_simple_transform(transform, source_exprs)
+                return out if default is None else pl.coalesce([out, pl.lit(default)])
             else:
-                expr = coerce_simple_transform(transform, src_expr)
-                logger.info(f"  Coerced expression: {expr}")
-                # Check if it's a FILTER operation that should return None
-                if isinstance(expr, tuple) and expr[0] in ["FILTERS", "FILTER"]:
-                    return None
-                return expr
+                # Single-column transforms see the same defaulted value as an untransformed mapping
+                return coerce_simple_transform(transform, src_expr)
         except Exception as e:
             logger.error(f"  Transform failed: {e}")
             raise TransformError(f"Failed to apply transform for target '{target}': {e}") from e
     else:
-        if source is None and default is None:
+        if not mapping.sources and default is None:
             raise MappingError(f"Mapping for target '{target}' requires at least one of source/transform/default.")
-        logger.info(f"  No transform, using source expression")
         return src_expr
 
-def _apply_filter(df: pl.DataFrame, mapping: Dict[str, Any]) -> pl.DataFrame:
-    """Apply a single filter mapping to the DataFrame."""
-    transform = str(mapping.get("trns", mapping.get("transform", ""))).strip()
-    
+# FILTER/FILTERS method -> function compiling its args into a filter step
+_FILTER_COMPILERS: Dict[str, Callable[[Tuple[str, ...]], FilterStep]] = {
+    "INCLUDE_IF": lambda args: ("filter", parse_boolean_expr(args[0])),
+    "EXCLUDE_IF": lambda args: ("filter", ~parse_boolean_expr(args[0])),
+    "LIMIT": lambda args: ("head", int(float(args[0]))),
+    "OFFSET": lambda args: ("slice", int(float(args[0]))),
+    # Handle FILTER[INCLUDE(...)] format
+    "INCLUDE": lambda args: ("filter", parse_boolean_expr(args[0])),
+}
+
+# Filter step kind -> function applying it to the lazy query
+_FILTER_STEPS: Dict[str, Callable[[pl.LazyFrame, Any], pl.LazyFrame]] = {
+    "filter": lambda lf, predicate: lf.filter(predicate),
+    "head": lambda lf, n: lf.head(n),
+    "slice": lambda lf, offset: lf.slice(offset),
+}
+
+def _compile_filter(method: str, args: Tuple[str, ...]) -> FilterStep:
     try:
-        expr = parse_transform_expression(transform)
-        if isinstance(expr, tuple) and expr[0] in ["FILTERS", "FILTER"]:
-            method = expr[1].upper()
-            args = expr[2]
-            if method == "INCLUDE_IF":
-                cond = parse_boolean_expr(args[0])
-                return df.filter(cond)
-            elif method == "EXCLUDE_IF":
-                cond = parse_boolean_expr(args[0])
-                return df.filter(~cond)
-            elif method == "LIMIT":
-                n = int(float(args[0]))
-                return df.head(n)
-            elif method == "OFFSET":
-                n = int(float(args[0]))
-                return df.slice(n)
-            elif method == "INCLUDE":
-                # Handle FILTER[INCLUDE(...)] format
-                cond = parse_boolean_expr(args[0])
-                return df.filter(cond)
-            else:
-                raise TransformError(f"Unsupported FILTER/FILTERS method: {method}")
-        else:
-            # Not a filter operation, return original DataFrame
-            return df
+        compile_step = _FILTER_COMPILERS.get(method)
+        if compile_step is None:
+            raise TransformError(f"Unsupported FILTER/FILTERS method: {method}")
+        return compile_step(args)
     except Exception as e:
-        raise TransformError(f"Failed to apply FILTER transform: {e}") from e
+        raise TransformError(f"Failed to apply FILTER/FILTERS transform: {e}") from e
 
-def _apply_filters(df: pl.DataFrame, mappings: List[Dict[str, Any]]) -> pl.DataFrame:
-    out = df
-    for mp in mappings:
-        # Handle both old format (transform) and new format (trns)
-        transform = str(mp.get("transform", mp.get("trns", ""))).strip()
-        # Check for both trns: prefix and direct FILTER operations
-        is_filter_op = ("FILTERS[" in transform.upper() or "FILTER[" in transform.upper())
-        if (transform.lower().startswith("trns:") and is_filter_op) or (not transform.lower().startswith("trns:") and is_filter_op):
-            try:
-                expr = parse_transform_expression(transform)
-                if isinstance(expr, tuple) and expr[0] in ["FILTERS", "FILTER"]:
-                    method = expr[1].upper()
-                    args = expr[2]
-                    if method == "INCLUDE_IF":
-                        cond = parse_boolean_expr(args[0])
-                        out = out.filter(cond)
-                    elif method == "EXCLUDE_IF":
-                        cond = parse_boolean_expr(args[0])
-                        out = out.filter(~cond)
-                    elif method == "LIMIT":
-                        n = int(float(args[0]))
-                        out = out.head(n)
-                    elif method == "OFFSET":
-                        n = int(float(args[0]))
-                        out = out.slice(n)
-                    elif method == "INCLUDE":
-                        # Handle FILTER[INCLUDE(...)] format
-                        cond = parse_boolean_expr(args[0])
-                        out = out.filter(cond)
-                    else:
-                        raise TransformError(f"Unsupported FILTER/FILTERS method: {method}")
-            except Exception as e:
-                raise TransformError(f"Failed to apply FILTER/FILTERS transform: {e}") from e
+def _merge_predicates(steps: List[FilterStep]) -> List[FilterStep]:
+    """AND adjacent predicates so each run between LIMIT/OFFSET steps is one filter."""
+    merged: List[FilterStep] = []
+    for kind, value in steps:
+        if kind == "filter" and merged and merged[-1][0] == "filter":
+            merged[-1] = ("filter", merged[-1][1] & value)
+        else:
+            merged.append((kind, value))
+    return merged
+
+def _apply_filters(lf: pl.LazyFrame, filters: List[FilterStep]) -> pl.LazyFrame:
+    """Chain compiled filter steps onto the lazy query in mapping order."""
+    out = lf
+    for kind, value in filters:
+        out = _FILTER_STEPS[kind](out, value)
     return out
 
-def apply_transformations(df: pl.DataFrame, mappings: List[Dict]) -> pl.DataFrame:
+def compile_mappings(df: Union[pl.DataFrame, pl.LazyFrame], mappings: List[Union[Dict, NormalizedMapping]], schema: Optional[pl.Schema] = None) -> CompiledMappings:
     """
-    Apply transformations to a DataFrame based on mapping configuration.
-    
-    Args:
-        df: Input Polars DataFrame
-        mappings: List of mapping dictionaries
-        
+    Build the projection expressions and filter steps for a mapping list.
+
+    The result depends only on the mappings and the input schema, so it can be
+    reused for any DataFrame with the same schema. Pass an already resolved
+    schema to avoid resolving it again from a lazy input. Filter predicates are
+    compiled here too, and adjacent ones are ANDed into a single filter.
+
     Returns:
-        Transformed Polars DataFrame
+        Tuple of (select expressions, filter steps)
     """
-    import time
-    
     if not mappings:
         raise TransformError("Mappings list cannot be empty")
-    
-    # Add detailed logging for debugging
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    # Start transformation timing
-    transform_start = time.time()
-    
-    # Log to logger
-    logger.info(f"=== TRANSFORMATION DEBUG INFO ===")
-    logger.info(f"Input DataFrame shape: {df.shape}")
-    logger.info(f"Input DataFrame schema: {df.schema}")
-    
-    # Log sample data for each column
-    logger.info("Sample data from each column:")
-    for col_name, dtype in df.schema.items():
-        try:
-            sample_values = df.select(pl.col(col_name)).head(3).to_series().to_list()
-            logger.info(f"  {col_name} ({dtype}): {sample_values}")
-        except Exception as e:
-            logger.warning(f"  {col_name} ({dtype}): Error getting sample - {e}")
-    
-    logger.info(f"Number of mappings to apply: {len(mappings)}")
-    for i, mp in enumerate(mappings):
-        logger.info(f"  Mapping {i+1}: {mp.get('id', 'no_id')} -> {mp.get('affected_target', mp.get('target', 'no_target'))}")
-        logger.info(f"    Transform: {mp.get('trns', 'no_trns')}")
-        logger.info(f"    Source: {mp.get('affected_source', mp.get('source', 'no_source'))}")
-    
-    # Build expressions for each mapping
+
+    if schema is None:
+        schema = df.lazy().collect_schema()
+
+    # Single pass: build a projection or collect a filter for each mapping
     select_exprs = []
-    mapping_times = []
+    filters: List[FilterStep] = []
+    mapping_times_ns = []
     
-    for mp in mappings:
-        mapping_start = time.time()
-        expr = _build_expr_for_mapping(df, mp)
-        mapping_time = (time.time() - mapping_start) * 1000
-        mapping_times.append(mapping_time)
+    for raw in mappings:
+        mp = raw if isinstance(raw, NormalizedMapping) else normalize_mapping(raw)
+        if ENABLE_MAPPING_PROFILING:
+            mapping_start = time.perf_counter_ns()
+            expr = _build_expr_for_mapping(schema, mp)
+            mapping_times_ns.append(time.perf_counter_ns() - mapping_start)
+        else:
+            expr = _build_expr_for_mapping(schema, mp)
         
-        # Skip None expressions (filter operations)
-        if expr is None:
-            logger.info(f"Skipping filter mapping: {mp.get('id', 'no_id')}")
+        # Filter operations are applied to the query, not projected
+        if isinstance(expr, tuple):
+            filters.append(_compile_filter(expr[1].upper(), expr[2]))
             continue
             
-        # Log the final expression being built
-        logger.info(f"Final expression for {mp.get('affected_target', mp.get('target', 'no_target'))}: {expr}")
-        select_exprs.append(expr.alias(mp.get('affected_target', mp.get('target', 'no_target'))))
+        select_exprs.append(expr.alias(mp.target))
     
-    logger.info(f"Total expressions to apply: {len(select_exprs)}")
-    logger.info("=== END TRANSFORMATION DEBUG INFO ===")
+    filters = _merge_predicates(filters)
+    logger.debug(f"Built {len(select_exprs)} expressions and {len(filters)} filter steps from {len(mappings)} mappings")
+    if mapping_times_ns:
+        avg_mapping_time = sum(mapping_times_ns) / len(mapping_times_ns) / 1e6
+        logger.info(f"Average mapping build time: {avg_mapping_time:.2f}ms")
+    return select_exprs, filters
+
+def apply_transformations(df: Union[pl.DataFrame, pl.LazyFrame], mappings: List[Dict], compiled: Optional[CompiledMappings] = None, lazy: bool = False) -> Union[pl.DataFrame, pl.LazyFrame]:
+    """
+    Apply transformations to a DataFrame based on mapping configuration.
+
+    Each mapping is parsed once and classified as either a filter or a
+    projection. Filters and projections are chained onto a single lazy query
+    so Polars can optimize and execute the whole plan in one pass.
+    
+    Args:
+        df: Input Polars DataFrame or LazyFrame (e.g. from scan_parquet)
+        mappings: List of mapping dictionaries
+        compiled: Optional result of compile_mappings for this schema, to skip rebuilding expressions
+        lazy: Return the uncollected LazyFrame so the writer can stream it to disk
+        
+    Returns:
+        Transformed Polars DataFrame (LazyFrame when lazy=True)
+    """
+    # Start transformation timing
+    transform_start = time.perf_counter_ns()
+    
+    # Sampling every column is expensive, so only do it when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        sample = df.lazy().head(3).collect()
+        sample_schema = sample.schema
+        logger.debug(f"Input schema: {sample_schema}")
+        logger.debug("Sample data from each column:")
+        for col_name, dtype in sample_schema.items():
+            logger.debug(f"  {col_name} ({dtype}): {sample[col_name].to_list()}")
+    
+    select_exprs, filters = compiled if compiled is not None else compile_mappings(df, mappings)
     
     # Apply transformations
-    execution_start = time.time()
+    execution_start = time.perf_counter_ns()
     try:
-        # Apply any filters first
-        df2 = df
-        for mp in mappings:
-            if mp.get('trns', '').startswith('FILTER[') or mp.get('trns', '').startswith('FILTERS['):
-                df2 = _apply_filter(df2, mp)
-        
-        # Apply all transformations
-        out = df2.select(select_exprs)
-        execution_time = (time.time() - execution_start) * 1000
+        # Chain filters and projections into one lazy plan, collected once
+        lf = _apply_filters(df.lazy(), filters).select(select_exprs)
+        if lazy:
+            logger.info("Transformation plan built; execution deferred to streaming writer")
+            return lf
+        out = lf.collect(streaming=True)
+        execution_time = (time.perf_counter_ns() - execution_start) / 1e6
         
         # Log performance metrics
-        total_transform_time = (time.time() - transform_start) * 1000
-        avg_mapping_time = sum(mapping_times) / len(mapping_times) if mapping_times else 0
+        total_transform_time = (time.perf_counter_ns() - transform_start) / 1e6
         
         logger.info(f"Transformation execution completed in {execution_time:.2f}ms")
-        logger.info(f"Average mapping build time: {avg_mapping_time:.2f}ms")
         logger.info(f"Total transformation time: {total_transform_time:.2f}ms")
         
         return out
         
     except Exception as e:
-        execution_time = (time.time() - execution_start) * 1000
+        execution_time = (time.perf_counter_ns() - execution_start) / 1e6
         logger.error(f"Transformation execution failed after {execution_time:.2f}ms: {e}")
         raise TransformError(f"Transformation failed: {e}")
@@ -1,125 +1,239 @@
+import os
 import re
+import operator
+import functools
+import uuid
 import datetime as _dt
 import polars as pl
-from typing import Optional, Union, Any
+from typing import Callable, Optional, Union, Any, List, Tuple
 
 _DEFAULT_DATE_FMT = "%m%d%Y"  # Interpreting MMDDCCYY as MMDDYYYY as a practical default
+_PARSE_CACHE_SIZE = 4096
+
+# Parser patterns, compiled once at import
+_ATTR_LOWER_RE = re.compile(r"attr\(\s*['\"](.+?)['\"]\s*\)", re.IGNORECASE)
+_ATTR_UPPER_RE = re.compile(r"ATTR\(\s*([^)]+)\s*\)")
+_CONCAT_SEP_RE = re.compile(r"concat\s*\(\s*['\"](.*?)['\"]\s*\)", re.IGNORECASE)
+_DATE_FORMAT_RE = re.compile(r"date_format\s*\(\s*['\"](.+?)['\"]\s*\)", re.IGNORECASE)
+_TO_DATE_RE = re.compile(r"to_date\s*\(\s*['\"](.+?)['\"]\s*\)", re.IGNORECASE)
+_NUM_MATCH = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?").fullmatch
+
+# Bracketed DSL operations accepted without the 'trns:' prefix
+_DSL_PREFIXES = ("MATH[", "STRING[", "LOGICAL[", "BOOLEAN[", "FILTER[", "FILTERS[", "DATE[", "ARRAY[", "DIRECT[", "AGGREGATION[")
+_BARE_COMPARISON_PREFIXES = ("EQ(", "GT(", "LT(", "GTE(", "LTE(", "NE(")
+
+# Comparison methods and infix symbols; pl.Expr overloads these operators
+_BOOL_OPS = {
+    "EQ": operator.eq, "EQUALS": operator.eq, "==": operator.eq,
+    "NE": operator.ne, "NOT_EQUALS": operator.ne, "!=": operator.ne,
+    "GT": operator.gt, "GREATER_THAN": operator.gt, ">": operator.gt,
+    "LT": operator.lt, "LESS_THAN": operator.lt, "<": operator.lt,
+    "GTE": operator.ge, "GREATER_OR_EQUAL": operator.ge, ">=": operator.ge,
+    "LTE": operator.le, "LESS_OR_EQUAL": operator.le, "<=": operator.le,
+}
+
+def has_trns_prefix(expr: str) -> bool:
+    """Case-insensitive check for a leading 'trns:' without lowercasing the whole string."""
+    return expr[:5].lower() == "trns:"
+
+def _is_cacheable(expr: str) -> bool:
+    # CURRENT_DATE is resolved at parse time, so those expressions must not be memoized
+    return "CURRENT_DATE" not in expr.upper()
+
+# Directories already created by this process; skips repeated makedirs syscalls
+_CREATED_DIRS = set()
+
+def ensure_dir(path: str) -> None:
+    """Create a directory once per process; later calls for the same path are free."""
+    if not path or path in _CREATED_DIRS:
+        return
+    os.makedirs(path, exist_ok=True)
+    _CREATED_DIRS.add(path)
+
+def forget_dir(path: str) -> None:
+    """Drop a directory from the ensure_dir cache, e.g. after it was removed externally."""
+    _CREATED_DIRS.discard(path)
 
 def timestamp_run_id():
-    return _dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+    # The random suffix keeps concurrent runs started in the same second apart
+    return f"{_dt.datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
 
 def is_number(s: str) -> bool:
-    try:
-        float(s)
-        return True
-    except:
-        return False
+    # Pattern match instead of float() so non-numeric tokens don't raise
+    return _NUM_MATCH(s.strip()) is not None
 
 def try_parse_literal(token: str):
     token = token.strip()
+    if not token:
+        return None
+    # Dispatch on the first character so column names skip the literal checks
+    first = token[0]
     # strings in single or double quotes
-    if (len(token) >= 2) and ((token[0] == token[-1]) and token[0] in ("'", '"')):
-        return pl.lit(token[1:-1])
+    if first in "'\"":
+        if len(token) >= 2 and token[-1] == first:
+            return pl.lit(token[1:-1])
+        return None
     # numbers
-    if is_number(token):
-        if "." in token:
-            return pl.lit(float(token))
-        else:
-            return pl.lit(int(float(token)))
+    if first in "+-.0123456789":
+        if is_number(token):
+            if "." in token:
+                return pl.lit(float(token))
+            else:
+                return pl.lit(int(float(token)))
+        return None
     # booleans
-    if token.lower() == "true":
-        return pl.lit(True)
-    if token.lower() == "false":
-        return pl.lit(False)
+    if first in "tTfF":
+        lowered = token.lower()
+        if lowered == "true":
+            return pl.lit(True)
+        if lowered == "false":
+            return pl.lit(False)
     return None
 
-def split_args(arg_str: str):
-    """Split a method args string by commas while respecting nested () and [] and quotes."""
-    args = []
-    cur = []
-    depth_paren = 0
-    depth_brack = 0
-    in_quote = None
-    i = 0
-    while i < len(arg_str):
-        ch = arg_str[i]
-        if in_quote:
-            cur.append(ch)
-            if ch == in_quote and (i == 0 or arg_str[i-1] != '\\'):
-                in_quote = None
-        else:
-            if ch in ("'", '"'):
+class _Tokenizer:
+    """
+    Index-based scanner over a DSL string.
+
+    Walks the text with an integer cursor, tracking quotes and ()/[] nesting,
+    and only slices substrings once a token or argument boundary is found.
+    """
+    __slots__ = ("text", "n")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.n = len(text)
+
+    def skip_ws(self, i: int) -> int:
+        text, n = self.text, self.n
+        while i < n and text[i].isspace():
+            i += 1
+        return i
+
+    def ident(self, i: int) -> Tuple[str, int]:
+        """Read an identifier starting at i; returns ('', i) when there is none."""
+        text, n = self.text, self.n
+        j = i
+        while j < n and (text[j].isalnum() or text[j] == "_"):
+            j += 1
+        return text[i:j], j
+
+    def call(self, i: int, open_ch: str, close_ch: str) -> Optional[Tuple[str, int, int]]:
+        """Match IDENT open_ch ... close_ch running to the end of the text.
+
+        Returns the identifier and the [start, end) bounds of the enclosed text.
+        """
+        name, j = self.ident(i)
+        if not name:
+            return None
+        j = self.skip_ws(j)
+        end = self.n - 1
+        if j >= end or self.text[j] != open_ch or self.text[end] != close_ch:
+            return None
+        return name, j + 1, end
+
+    def split_args(self, start: int = 0, end: Optional[int] = None) -> List[str]:
+        """Split text[start:end] on top-level commas, respecting nesting and quotes."""
+        text = self.text
+        end = self.n if end is None else end
+        args = []
+        depth_paren = 0
+        depth_brack = 0
+        in_quote = None
+        seg = start
+        for i in range(start, end):
+            ch = text[i]
+            if in_quote:
+                if ch == in_quote and (i == start or text[i-1] != '\\'):
+                    in_quote = None
+            elif ch == "'" or ch == '"':
                 in_quote = ch
-                cur.append(ch)
             elif ch == "(":
                 depth_paren += 1
-                cur.append(ch)
             elif ch == ")":
                 depth_paren -= 1
-                cur.append(ch)
             elif ch == "[":
                 depth_brack += 1
-                cur.append(ch)
             elif ch == "]":
                 depth_brack -= 1
-                cur.append(ch)
             elif ch == "," and depth_paren == 0 and depth_brack == 0:
-                args.append("".join(cur).strip())
-                cur = []
-            else:
-                cur.append(ch)
-        i += 1
-    if cur:
-        args.append("".join(cur).strip())
-    return args
+                args.append(text[seg:i].strip())
+                seg = i + 1
+        if seg < end:
+            args.append(text[seg:end].strip())
+        return args
+
+    def find_comparison(self) -> Optional[Tuple[int, str]]:
+        """Position and text of the first top-level comparison operator, if any."""
+        text, n = self.text, self.n
+        depth = 0
+        in_quote = None
+        for i in range(n):
+            ch = text[i]
+            if in_quote:
+                if ch == in_quote and (i == 0 or text[i-1] != '\\'):
+                    in_quote = None
+            elif ch == "'" or ch == '"':
+                in_quote = ch
+            elif ch in "([":
+                depth += 1
+            elif ch in ")]":
+                depth -= 1
+            elif depth == 0 and ch in "=!<>":
+                if i + 1 < n and text[i+1] == "=":
+                    return i, ch + "="
+                if ch in "<>":
+                    return i, ch
+        return None
+
+def split_args(arg_str: str):
+    """Split a method args string by commas while respecting nested () and [] and quotes."""
+    return _Tokenizer(arg_str).split_args()
+
+def _call_parts(text: str) -> Optional[Tuple[str, List[str]]]:
+    """Split METHOD(arg1, arg2, ...) into the upper-cased method name and its args."""
+    tok = _Tokenizer(text)
+    call = tok.call(0, "(", ")")
+    if call is None:
+        return None
+    name, start, end = call
+    return name.upper(), tok.split_args(start, end)
 
 def parse_attr(token: str):
     # Handle both attr('column') and ATTR(column) formats
-    m = re.fullmatch(r"attr\(\s*['\"](.+?)['\"]\s*\)", token.strip(), re.IGNORECASE)
+    token = token.strip()
+    m = _ATTR_LOWER_RE.fullmatch(token)
     if not m:
         # Try ATTR(column) format
-        m = re.fullmatch(r"ATTR\(\s*([^)]+)\s*\)", token.strip())
+        m = _ATTR_UPPER_RE.fullmatch(token)
     if not m:
         return None
     col = m.group(1).strip()
     return pl.col(col)
 
 def parse_boolean_expr(expr: str):
+    """Parse a boolean condition into a Polars expression (memoized by expression string)."""
     expr = expr.strip()
+    if _is_cacheable(expr):
+        return _parse_boolean_expr_cached(expr)
+    return _parse_boolean_expr(expr)
+
+def _boolean_from_method(method: str, args: List[str]):
+    """Build a comparison from a method name (or infix symbol) and its two operands."""
+    fn = _BOOL_OPS.get(method)
+    if fn is None:
+        raise ValueError(f"Unsupported BOOLEAN method: {method}")
+    a, b = args
+    return fn(parse_value(a), parse_value(b))
+
+def _parse_boolean_expr(expr: str):
     # BOOLEAN[...] form
     if expr.startswith("BOOLEAN[") and expr.endswith("]"):
         inner = expr[len("BOOLEAN["):-1].strip()
         # method(args)
-        m2 = re.match(r"(\w+)\s*\((.*)\)$", inner, re.DOTALL)
-        if not m2:
+        parts = _call_parts(inner)
+        if parts is None:
             raise ValueError(f"Malformed BOOLEAN expression: {expr}")
-        method = m2.group(1).upper()
-        args = split_args(m2.group(2))
-        if method == "EQUALS":
-            a, b = args
-            return parse_value(a).eq(parse_value(b))
-        if method == "EQ":
-            a, b = args
-            return parse_value(a).eq(parse_value(b))
-        if method == "NOT_EQUALS":
-            a, b = args
-            return parse_value(a).ne(parse_value(b))
-        if method == "GREATER_THAN":
-            a, b = args
-            return parse_value(a) > parse_value(b)
-        if method == "GT":
-            a, b = args
-            return parse_value(a) > parse_value(b)
-        if method == "LESS_THAN":
-            a, b = args
-            return parse_value(a) < parse_value(b)
-        if method == "GREATER_OR_EQUAL":
-            a, b = args
-            return parse_value(a) >= parse_value(b)
-        if method == "LESS_OR_EQUAL":
-            a, b = args
-            return parse_value(a) <= parse_value(b)
-        raise ValueError(f"Unsupported BOOLEAN method: {method}")
+        return _boolean_from_method(*parts)
     
     # Handle IF statements for FILTER operations
     if expr.startswith("IF(") and expr.endswith(")"):
@@ -134,57 +248,22 @@ def parse_boolean_expr(expr: str):
             raise ValueError(f"IF statement requires 3 arguments: {expr}")
     
     # Handle BOOLEAN method calls for FILTER operations
-    if expr.startswith("EQ(") or expr.startswith("GT(") or expr.startswith("LT(") or expr.startswith("GTE(") or expr.startswith("LTE(") or expr.startswith("NE("):
+    if expr.startswith(_BARE_COMPARISON_PREFIXES):
         # Extract method name and arguments
-        m = re.match(r"(\w+)\s*\((.*)\)$", expr.strip(), re.DOTALL)
-        if m:
-            method = m.group(1).upper()
-            args_str = m.group(2)
-            args = split_args(args_str)
-            if method == "EQ":
-                a, b = args
-                return parse_value(a).eq(parse_value(b))
-            elif method == "GT":
-                a, b = args
-                return parse_value(a) > parse_value(b)
-            elif method == "LT":
-                a, b = args
-                return parse_value(a) < parse_value(b)
-            elif method == "GTE":
-                a, b = args
-                return parse_value(a) >= parse_value(b)
-            elif method == "LTE":
-                a, b = args
-                return parse_value(a) <= parse_value(b)
-            elif method == "NE":
-                a, b = args
-                return parse_value(a).ne(parse_value(b))
-            else:
-                raise ValueError(f"Unsupported BOOLEAN method: {method}")
-        else:
+        parts = _call_parts(expr)
+        if parts is None:
             raise ValueError(f"Malformed BOOLEAN expression: {expr}")
+        return _boolean_from_method(*parts)
     
-    # simple: left OP right (supports ==, !=, >=, <=, >, <)
-    ops = ["==", "!=", ">=", "<=", ">", "<"]
-    for op in ops:
-        if op in expr:
-            left, right = expr.split(op, 1)
-            l = parse_value(left.strip())
-            r = parse_value(right.strip())
-            if op == "==":
-                return l.eq(r)
-            if op == "!=":
-                return l.ne(r)
-            if op == ">":
-                return l > r
-            if op == "<":
-                return l < r
-            if op == ">=":
-                return l >= r
-            if op == "<=":
-                return l <= r
+    # simple: left OP right (supports ==, !=, >=, <=, >, <), split at the first top-level operator
+    found = _Tokenizer(expr).find_comparison()
+    if found is not None:
+        pos, op = found
+        return _boolean_from_method(op, [expr[:pos], expr[pos + len(op):]])
     raise ValueError(f"Unsupported boolean condition: {expr}")
 
+_parse_boolean_expr_cached = functools.lru_cache(maxsize=_PARSE_CACHE_SIZE)(_parse_boolean_expr)
+
 def parse_date_format(fmt: Optional[str]) -> str:
     # Accept user-given format; if absent, use default MMDDYYYY
     return fmt or _DEFAULT_DATE_FMT
@@ -212,13 +291,10 @@ def parse_value(token: str):
 
 def parse_method_call(op: str, content: str):
     # content looks like: METHOD(arg1, arg2, ...)
-    m = re.match(r"(\w+)\s*\((.*)\)$", content.strip(), re.DOTALL)
-    if not m:
+    parts = _call_parts(content.strip())
+    if parts is None:
         raise ValueError(f"Malformed method in {op}[{content}]")
-    method = m.group(1).upper()
-    args_str = m.group(2)
-    args = split_args(args_str)
-    return method, args
+    return parts
 
 def parse_transform_expression(expr: str):
     """
@@ -228,303 +304,312 @@ def parse_transform_expression(expr: str):
     and return a Polars expression.
     
     Also handles expressions without 'trns:' prefix for backward compatibility.
+    Results are memoized by expression string.
     """
     expr = expr.strip()
+    if _is_cacheable(expr):
+        return _parse_transform_expression_cached(expr)
+    return _parse_transform_expression(expr)
+
+def _is_column(expr: Any) -> bool:
+    # Column-based input (a column or anything computed from one, e.g. col('a').str.strip_chars()),
+    # read from the expression tree instead of formatting it to sniff a 'col(' prefix
+    return isinstance(expr, pl.Expr) and bool(expr.meta.root_names())
+
+def _as_utf8(expr: pl.Expr, strict: bool = True) -> pl.Expr:
+    """Cast to Utf8 unless the expression is already known to produce strings."""
+    # pl.Expr has no dtype before schema resolution, so string-ness is tracked with a tag
+    if getattr(expr, "_is_utf8", False):
+        return expr
+    return expr.cast(pl.Utf8, strict=strict)
+
+def _utf8(expr: pl.Expr) -> pl.Expr:
+    """Tag an expression as producing strings so enclosing string ops skip the cast."""
+    try:
+        expr._is_utf8 = True
+    except AttributeError:
+        pass
+    return expr
+
+def _string_base(arg: str):
+    return _as_utf8(parse_value(arg))
+
+def _string_concat(args):
+    # Adjacent quoted literals are joined at parse time into a single pl.lit
+    parts = []
+    pending = []
+    for arg in args:
+        arg = arg.strip()
+        if len(arg) >= 2 and arg[0] in "'\"" and arg[-1] == arg[0]:
+            pending.append(arg[1:-1])
+            continue
+        # Empty literals add nothing to the result, so they are dropped
+        if pending and "".join(pending):
+            parts.append(pl.lit("".join(pending)))
+        pending = []
+        parts.append(parse_value(arg))
+    text = "".join(pending)
+    if not parts:
+        # Only literals: the whole concatenation is a constant
+        return pl.lit(text)
+    if text:
+        parts.append(pl.lit(text))
+    return pl.concat_str(parts, separator="")
+
+def _string_substr(args):
+    base = _string_base(args[0])
+    start = parse_value(args[1])
+    length = parse_value(args[2]) if len(args) > 2 else None
+    if length is None:
+        return _utf8(base.str.slice(start))
+    return _utf8(base.str.slice(start, length))
+
+def _date_format(args):
+    base = parse_value(args[0])
+    fmt = args[1].strip().strip("'\"")
     
-    # Handle both formats: with and without 'trns:' prefix
-    if expr.lower().startswith("trns:"):
-        m = re.match(r"trns:\s*(\w+)\s*\[(.*)\]\s*$", expr, re.DOTALL | re.IGNORECASE)
+    # Check if this is a column reference and handle both datetime and string dates
+    if _is_column(base):
+        # This is a column reference - handle both datetime and string columns
+        # Use a runtime approach that works with both types
+        # We'll use a simple string parsing approach that works with both
+        return base.str.strptime(pl.Datetime, fmt, strict=False).dt.strftime(fmt)
     else:
-        # New format without 'trns:' prefix
-        m = re.match(r"(\w+)\s*\[(.*)\]\s*$", expr, re.DOTALL | re.IGNORECASE)
-    
-    if not m:
-        raise ValueError(f"Malformed transform expression: {expr}")
-    op = m.group(1).upper()
-    inner = m.group(2).strip()
-    method, args = parse_method_call(op, inner)
-
-    # Dispatch
-    if op == "MATH":
-        a = parse_value(args[0])
-        if method == "ADD":
-            return a + parse_value(args[1])
-        if method == "SUB":
-            return a - parse_value(args[1])
-        if method == "MUL":
-            return a * parse_value(args[1])
-        if method == "DIV":
-            return a / parse_value(args[1])
-        if method == "MOD":
-            return a % parse_value(args[1])
-        if method == "ROUND":
-            prec = int(float(str(args[1]).strip()))
-            return a.round(prec)
-        if method == "ABS":
-            return a.abs()
-        raise ValueError(f"Unsupported MATH method: {method}")
-
-    if op == "STRING":
-        if method == "CONCAT":
-            parts = [parse_value(arg) for arg in args]
-            return pl.concat_str(parts)
-        if method == "SUBSTR":
-            base = parse_value(args[0])
-            # Only cast if not already string
-            if not base.dtype == pl.Utf8:
-                base = base.cast(pl.Utf8)
-            start = parse_value(args[1])
-            length = parse_value(args[2]) if len(args) > 2 else None
-            if length is None:
-                return base.str.slice(start)
-            return base.str.slice(start, length)
-        if method == "REPLACE":
-            base = parse_value(args[0])
-            # Only cast if not already string
-            if not base.dtype == pl.Utf8:
-                base = base.cast(pl.Utf8)
-            find = parse_value(args[1])
-            repl = parse_value(args[2])
-            return base.str.replace_all(find, repl)
-        if method == "UPPER":
-            base = parse_value(args[0])
-            # Only cast if not already string
-            if not base.dtype == pl.Utf8:
-                base = base.cast(pl.Utf8)
-            return base.str.to_uppercase()
-        if method == "LOWER":
-            base = parse_value(args[0])
-            # Only cast if not already string
-            if not base.dtype == pl.Utf8:
-                base = base.cast(pl.Utf8)
-            return base.str.to_lowercase()
-        if method == "TRIM":
-            base = parse_value(args[0])
-            # Only cast if not already string
-            if not base.dtype == pl.Utf8:
-                base = base.cast(pl.Utf8)
-            return base.str.strip_chars()
-        if method == "LENGTH":
-            base = parse_value(args[0])
-            # Only cast if not already string
-            if not base.dtype == pl.Utf8:
-                base = base.cast(pl.Utf8)
-            return base.str.len_chars()
-        raise ValueError(f"Unsupported STRING method: {method}")
-
-    if op == "LOGICAL":
-        if method == "IF":
-            cond = parse_boolean_expr(args[0])
-            tv = parse_value(args[1])
-            fv = parse_value(args[2])
-            return pl.when(cond).then(tv).otherwise(fv)
-        if method == "AND":
-            exps = [parse_boolean_expr(a) for a in args]
-            out = exps[0]
-            for e in exps[1:]:
-                out = out & e
-            return out
-        if method == "OR":
-            exps = [parse_boolean_expr(a) for a in args]
-            out = exps[0]
-            for e in exps[1:]:
-                out = out | e
-            return out
-        if method == "NOT":
-            return ~parse_boolean_expr(args[0])
-        raise ValueError(f"Unsupported LOGICAL method: {method}")
-
-    if op == "BOOLEAN":
-        inner = f"BOOLEAN[{method}({', '.join(args)})]"
-        return parse_boolean_expr(inner)
-
-    if op == "FILTERS":
-        return ("FILTERS", method, args)
-    
-    if op == "FILTER":
-        return ("FILTER", method, args)
+        # This is a literal or computed expression
+        try:
+            # Try to use it as datetime first
+            result = base.dt.strftime(fmt)
+            return result
+        except Exception as e:
+            # If that fails, try to parse it as a string and format it
+            try:
+                result = base.str.strptime(pl.Datetime, fmt, strict=False).dt.strftime(fmt)
+                return result
+            except Exception as e2:
+                # Fallback: return the original string as-is
+                return base
+
+def _date_parse(args):
+    base = parse_value(args[0]).cast(pl.Utf8)
+    fmt = parse_date_format(args[1].strip().strip("'\"") if len(args) > 1 else None)
+    return base.str.strptime(pl.Date, fmt, strict=False)
+
+def _date_diff(args):
+    d1 = parse_value(args[0])
+    d2 = parse_value(args[1])
+    unit = args[2].strip().strip("'\"") if len(args) > 2 else "days"
     
-    if op == "DIRECT":
-        # DIRECT[ATTR('column')] - directly use the column value
-        if method == "ATTR":
-            return parse_value(args[0])
-        raise ValueError(f"Unsupported DIRECT method: {method}")
-
-    if op == "DATE":
-        if method == "FORMAT":
-            base = parse_value(args[0])
-            fmt = args[1].strip().strip("'\"")
-            
-            # Check if this is a column reference and handle both datetime and string dates
-            if isinstance(base, pl.Expr) and str(base).startswith('col('):
-                # This is a column reference - handle both datetime and string columns
-                # Use a runtime approach that works with both types
-                # We'll use a simple string parsing approach that works with both
-                return base.str.strptime(pl.Datetime, fmt, strict=False).dt.strftime(fmt)
-            else:
-                # This is a literal or computed expression
-                try:
-                    # Try to use it as datetime first
-                    result = base.dt.strftime(fmt)
-                    return result
-                except Exception as e:
-                    # If that fails, try to parse it as a string and format it
-                    try:
-                        result = base.str.strptime(pl.Datetime, fmt, strict=False).dt.strftime(fmt)
-                        return result
-                    except Exception as e2:
-                        # Fallback: return the original string as-is
-                        return base
-        if method == "PARSE":
-            base = parse_value(args[0]).cast(pl.Utf8)
-            fmt = parse_date_format(args[1].strip().strip("'\"") if len(args) > 1 else None)
-            return base.str.strptime(pl.Date, fmt, strict=False)
-        if method == "ADD_DAYS":
-            base = parse_value(args[0])
-            n = int(float(str(args[1])))
-            return base.dt.offset_by(f"{n}d")
-        if method == "SUB_DAYS":
-            base = parse_value(args[0])
-            n = int(float(str(args[1])))
-            return base.dt.offset_by(f"-{n}d")
-        if method == "DIFF_DAYS":
-            d1 = parse_value(args[0])
-            d2 = parse_value(args[1])
+    # Check if these are column references and handle both datetime and string columns
+    if _is_column(d1) and _is_column(d2):
+        # This is a column reference - handle both datetime and string columns
+        # Use a runtime approach that works with both types
+        if unit.lower() == "days":
+            # Parse both columns to datetime first, then calculate difference
+            # This works with both string and datetime columns
+            d1_parsed = d1.str.strptime(pl.Datetime, "%Y-%m-%d", strict=False)
+            d2_parsed = d2.str.strptime(pl.Datetime, "%Y-%m-%d", strict=False)
+            return (d1_parsed - d2_parsed).dt.total_days()
+        else:
+            raise ValueError(f"Unsupported DATE DIFF unit: {unit}")
+    else:
+        # Standard approach for non-column references
+        if unit.lower() == "days":
             return (d1 - d2).dt.total_days()
-        if method == "DIFF":
-            d1 = parse_value(args[0])
-            d2 = parse_value(args[1])
-            unit = args[2].strip().strip("'\"") if len(args) > 2 else "days"
-            
-            # Check if these are column references and handle both datetime and string columns
-            if (isinstance(d1, pl.Expr) and str(d1).startswith('col(') and 
-                isinstance(d2, pl.Expr) and str(d2).startswith('col(')):
-                # This is a column reference - handle both datetime and string columns
-                # Use a runtime approach that works with both types
-                if unit.lower() == "days":
-                    # Parse both columns to datetime first, then calculate difference
-                    # This works with both string and datetime columns
-                    d1_parsed = d1.str.strptime(pl.Datetime, "%Y-%m-%d", strict=False)
-                    d2_parsed = d2.str.strptime(pl.Datetime, "%Y-%m-%d", strict=False)
-                    return (d1_parsed - d2_parsed).dt.total_days()
-                else:
-                    raise ValueError(f"Unsupported DATE DIFF unit: {unit}")
-            else:
-                # Standard approach for non-column references
-                if unit.lower() == "days":
-                    return (d1 - d2).dt.total_days()
-                else:
-                    raise ValueError(f"Unsupported DATE DIFF unit: {unit}")
-        if method == "CURRENT_DATE":
-            import datetime as _dt
-            return pl.lit(_dt.date.today())
-        if method == "EXTRACT":
-            base = parse_value(args[0])
-            part = args[1].strip().strip("'\"").lower()
-            if part == "year":
-                return base.dt.year()
-            if part == "month":
-                return base.dt.month()
-            if part == "day":
-                return base.dt.day()
-            raise ValueError(f"Unsupported DATE EXTRACT part: {part}")
-        raise ValueError(f"Unsupported DATE method: {method}")
-
-    if op == "ARRAY":
-        if method == "JOIN":
-            base = parse_value(args[0])
-            delim = args[1].strip().strip("'\"")
-            # For ARRAY[JOIN], since we're working with comma-separated strings,
-            # we'll just return the string as-is for now to avoid list type issues
-            # This maintains compatibility while avoiding the Polars list type limitation
-            return base
-        if method == "SPLIT":
-            s = parse_value(args[0]).cast(pl.Utf8)
-            delim = args[1].strip().strip("'\"")
-            return s.str.split(delim)
-        if method == "LENGTH":
-            return parse_value(args[0]).arr.lengths()
-        if method == "GET":
-            return parse_value(args[0]).arr.get(parse_value(args[1]))
-        raise ValueError(f"Unsupported ARRAY method: {method}")
-
-    if op == "AGGREGATION":
-        if method == "SUM":
-            return parse_value(args[0]).arr.sum()
-        if method == "AVG":
-            return parse_value(args[0]).arr.mean()
-        if method == "MIN":
-            return parse_value(args[0]).arr.min()
-        if method == "MAX":
-            return parse_value(args[0]).arr.max()
-        if method == "COUNT":
-            return parse_value(args[0]).arr.lengths()
-        raise ValueError(f"Unsupported AGGREGATION method: {method}")
-
-    raise ValueError(f"Unsupported OPERATION: {op}")
-
-def coerce_simple_transform(transform: str, source_expr: pl.Expr) -> pl.Expr:
+        else:
+            raise ValueError(f"Unsupported DATE DIFF unit: {unit}")
+
+def _date_extract(args):
+    base = parse_value(args[0])
+    part = args[1].strip().strip("'\"").lower()
+    if part == "year":
+        return base.dt.year()
+    if part == "month":
+        return base.dt.month()
+    if part == "day":
+        return base.dt.day()
+    raise ValueError(f"Unsupported DATE EXTRACT part: {part}")
+
+def _array_join(args):
+    # For ARRAY[JOIN], since we're working with comma-separated strings,
+    # we'll just return the string as-is for now to avoid list type issues
+    # This maintains compatibility while avoiding the Polars list type limitation
+    return parse_value(args[0])
+
+# Per-operation method tables: METHOD -> builder taking the raw argument strings
+_MATH_METHODS = {
+    "ADD": lambda args: parse_value(args[0]) + parse_value(args[1]),
+    "SUB": lambda args: parse_value(args[0]) - parse_value(args[1]),
+    "MUL": lambda args: parse_value(args[0]) * parse_value(args[1]),
+    "DIV": lambda args: parse_value(args[0]) / parse_value(args[1]),
+    "MOD": lambda args: parse_value(args[0]) % parse_value(args[1]),
+    "ROUND": lambda args: parse_value(args[0]).round(int(float(str(args[1]).strip()))),
+    "ABS": lambda args: parse_value(args[0]).abs(),
+}
+
+_STRING_METHODS = {
+    "CONCAT": lambda args: _utf8(_string_concat(args)),
+    "SUBSTR": _string_substr,
+    "REPLACE": lambda args: _utf8(_string_base(args[0]).str.replace_all(parse_value(args[1]), parse_value(args[2]))),
+    "UPPER": lambda args: _utf8(_string_base(args[0]).str.to_uppercase()),
+    "LOWER": lambda args: _utf8(_string_base(args[0]).str.to_lowercase()),
+    "TRIM": lambda args: _utf8(_string_base(args[0]).str.strip_chars()),
+    "LENGTH": lambda args: _string_base(args[0]).str.len_chars(),
+}
+
+_LOGICAL_METHODS = {
+    "IF": lambda args: pl.when(parse_boolean_expr(args[0])).then(parse_value(args[1])).otherwise(parse_value(args[2])),
+    "AND": lambda args: functools.reduce(operator.and_, [parse_boolean_expr(a) for a in args]),
+    "OR": lambda args: functools.reduce(operator.or_, [parse_boolean_expr(a) for a in args]),
+    "NOT": lambda args: ~parse_boolean_expr(args[0]),
+}
+
+_DIRECT_METHODS = {
+    # DIRECT[ATTR('column')] - directly use the column value
+    "ATTR": lambda args: parse_value(args[0]),
+}
+
+_DATE_METHODS = {
+    "FORMAT": _date_format,
+    "PARSE": _date_parse,
+    "ADD_DAYS": lambda args: parse_value(args[0]).dt.offset_by(f"{int(float(str(args[1])))}d"),
+    "SUB_DAYS": lambda args: parse_value(args[0]).dt.offset_by(f"-{int(float(str(args[1])))}d"),
+    "DIFF_DAYS": lambda args: (parse_value(args[0]) - parse_value(args[1])).dt.total_days(),
+    "DIFF": _date_diff,
+    "CURRENT_DATE": lambda args: pl.lit(_dt.date.today()),
+    "EXTRACT": _date_extract,
+}
+
+_ARRAY_METHODS = {
+    "JOIN": _array_join,
+    "SPLIT": lambda args: parse_value(args[0]).cast(pl.Utf8).str.split(args[1].strip().strip("'\"")),
+    "LENGTH": lambda args: parse_value(args[0]).arr.lengths(),
+    "GET": lambda args: parse_value(args[0]).arr.get(parse_value(args[1])),
+}
+
+_AGGREGATION_METHODS = {
+    "SUM": lambda args: parse_value(args[0]).arr.sum(),
+    "AVG": lambda args: parse_value(args[0]).arr.mean(),
+    "MIN": lambda args: parse_value(args[0]).arr.min(),
+    "MAX": lambda args: parse_value(args[0]).arr.max(),
+    "COUNT": lambda args: parse_value(args[0]).arr.lengths(),
+}
+
+def _method_table(op: str, methods: dict) -> Callable[[str, List[str]], Any]:
+    def handler(method: str, args: List[str]):
+        fn = methods.get(method)
+        if fn is None:
+            raise ValueError(f"Unsupported {op} method: {method}")
+        return fn(args)
+    return handler
+
+def _boolean_op(method: str, args: List[str]):
+    # Args are already split; build the comparison directly rather than re-parsing a rebuilt string
+    return _boolean_from_method(method, args)
+
+# OPERATION -> handler(method, args); FILTER ops come back as tuples for the transformer
+_OP_HANDLERS = {
+    "MATH": _method_table("MATH", _MATH_METHODS),
+    "STRING": _method_table("STRING", _STRING_METHODS),
+    "LOGICAL": _method_table("LOGICAL", _LOGICAL_METHODS),
+    "BOOLEAN": _boolean_op,
+    "FILTERS": lambda method, args: ("FILTERS", method, tuple(args)),
+    "FILTER": lambda method, args: ("FILTER", method, tuple(args)),
+    "DIRECT": _method_table("DIRECT", _DIRECT_METHODS),
+    "DATE": _method_table("DATE", _DATE_METHODS),
+    "ARRAY": _method_table("ARRAY", _ARRAY_METHODS),
+    "AGGREGATION": _method_table("AGGREGATION", _AGGREGATION_METHODS),
+}
+
+def _parse_transform_expression(expr: str):
+    # Handle both formats: with and without 'trns:' prefix, then OP[...]
+    tok = _Tokenizer(expr)
+    start = tok.skip_ws(5) if has_trns_prefix(expr) else 0
+    call = tok.call(start, "[", "]")
+    if call is None:
+        raise ValueError(f"Malformed transform expression: {expr}")
+    name, inner_start, inner_end = call
+    op = name.upper()
+    method, args = parse_method_call(op, expr[inner_start:inner_end])
+
+    handler = _OP_HANDLERS.get(op)
+    if handler is None:
+        raise ValueError(f"Unsupported OPERATION: {op}")
+    return handler(method, args)
+
+_parse_transform_expression_cached = functools.lru_cache(maxsize=_PARSE_CACHE_SIZE)(_parse_transform_expression)
+
+def is_multi_source_transform(transform: str) -> bool:
+    """True for simple transforms that combine every source column (concat/coalesce)."""
     t = transform.strip()
+    return t.lower() in ("concat", "coalesce", "first_non_null") or _CONCAT_SEP_RE.match(t) is not None
 
-    if t.lower().startswith("trns:"):
+def coerce_simple_transform(transform: str, source_expr: Union[pl.Expr, List[pl.Expr]]) -> pl.Expr:
+    """
+    Apply a simple (non-DSL) transform to the source expression.
+
+    source_expr may be a list of expressions for multi-source mappings; the
+    concat/coalesce transforms combine all of them in a single Polars kernel,
+    while single-column transforms use the first one. The transform string is
+    parsed once (memoized) and the result is applied to the given sources.
+    """
+    t = transform.strip()
+
+    # DSL expressions, with or without the 'trns:' prefix (FILTER ops come back as tuples)
+    if has_trns_prefix(t) or t.startswith(_DSL_PREFIXES):
         return parse_transform_expression(t)
-    
-    # Handle new format without 'trns:' prefix
-    if t.startswith(("MATH[", "STRING[", "LOGICAL[", "BOOLEAN[", "FILTER[", "DATE[", "ARRAY[", "DIRECT[")):
-        expr = parse_transform_expression(t)
-        # Check if it's a FILTER operation that should return None
-        if isinstance(expr, tuple) and expr[0] in ["FILTERS", "FILTER"]:
-            return expr
-        return expr
 
+    sources = source_expr if isinstance(source_expr, list) else [source_expr]
+    return _parse_simple(t)(sources)
+
+@functools.lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def _parse_simple(t: str) -> Callable[[List[pl.Expr]], pl.Expr]:
+    """Resolve a simple transform string once into a function of the source expressions."""
+    # Multi-source transforms combine every source column
+    t_lower = t.lower()
+    if t_lower == "concat":
+        return lambda sources: pl.concat_str(sources)
+    m = _CONCAT_SEP_RE.match(t)
+    if m:
+        separator = m.group(1)
+        return lambda sources: pl.concat_str(sources, separator=separator)
+    if t_lower in ("coalesce", "first_non_null"):
+        return lambda sources: pl.coalesce(sources)
+
+    # Single-column transforms use the first source
     if t == "to_int":
-        return source_expr.cast(pl.Int64, strict=False)
+        return lambda sources: sources[0].cast(pl.Int64, strict=False)
     if t == "to_float":
-        return source_expr.cast(pl.Float64, strict=False)
+        return lambda sources: sources[0].cast(pl.Float64, strict=False)
+    # String transforms only cast when the source isn't already known to be a string
     if t == "to_str":
-        # Only cast if not already string
-        if source_expr.dtype != pl.Utf8:
-            return source_expr.cast(pl.Utf8, strict=False)
-        else:
-            return source_expr
-
+        return lambda sources: _utf8(_as_utf8(sources[0], strict=False))
     if t == "to_bool":
-        # Only cast if not already string
-        if source_expr.dtype != pl.Utf8:
-            source_expr = source_expr.cast(pl.Utf8)
-        return (source_expr.str.to_lowercase().is_in(["1","true","y","yes"])).cast(pl.Boolean)
-
+        return lambda sources: (_as_utf8(sources[0]).str.to_lowercase().is_in(["1","true","y","yes"])).cast(pl.Boolean)
     if t == "trim":
-        # Only cast if not already string
-        if source_expr.dtype != pl.Utf8:
-            source_expr = source_expr.cast(pl.Utf8)
-        return source_expr.str.strip_chars()
+        return lambda sources: _utf8(_as_utf8(sources[0]).str.strip_chars())
     if t == "upper":
-        # Only cast if not already string
-        if source_expr.dtype != pl.Utf8:
-            source_expr = source_expr.cast(pl.Utf8)
-        return source_expr.str.to_uppercase()
+        return lambda sources: _utf8(_as_utf8(sources[0]).str.to_uppercase())
     if t == "lower":
-        # Only cast if not already string
-        if source_expr.dtype != pl.Utf8:
-            source_expr = source_expr.cast(pl.Utf8)
-        return source_expr.str.to_lowercase()
+        return lambda sources: _utf8(_as_utf8(sources[0]).str.to_lowercase())
 
-    m = re.match(r"date_format\s*\(\s*['\"](.+?)['\"]\s*\)", t, re.IGNORECASE)
+    m = _DATE_FORMAT_RE.match(t)
     if m:
         fmt = m.group(1)
-        # Handle both datetime and string inputs
-        try:
-            # Try to use it as datetime first
-            return source_expr.dt.strftime(fmt)
-        except:
-            # If that fails, try to parse it as a string and format it
-            # This handles the case where the column is a string representation of a date
-            return source_expr.str.strptime(pl.Datetime, fmt, strict=False).dt.strftime(fmt)
+        def date_format(sources):
+            source_expr = sources[0]
+            # Handle both datetime and string inputs
+            try:
+                # Try to use it as datetime first
+                return source_expr.dt.strftime(fmt)
+            except:
+                # If that fails, try to parse it as a string and format it
+                # This handles the case where the column is a string representation of a date
+                return source_expr.str.strptime(pl.Datetime, fmt, strict=False).dt.strftime(fmt)
+        return date_format
 
-    m = re.match(r"to_date\s*\(\s*['\"](.+?)['\"]\s*\)", t, re.IGNORECASE)
+    m = _TO_DATE_RE.match(t)
     if m:
         fmt = m.group(1) if m.group(1) else _DEFAULT_DATE_FMT
-        return source_expr.cast(pl.Utf8).str.strptime(pl.Date, fmt, strict=False)
+        return lambda sources: sources[0].cast(pl.Utf8).str.strptime(pl.Date, fmt, strict=False)
 
     raise ValueError(f"Unsupported simple transform: {t}")
@@ -1,44 +1,123 @@
 import os
-import json
 import polars as pl
-from openpyxl import Workbook
-from xml.sax.saxutils import escape
+import polars.selectors as cs
+import orjson
+import xlsxwriter
 from .exceptions import WriterError
-from typing import List, Dict, Any, Optional
+from .utils import ensure_dir, forget_dir
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 EXCEL_MAX_ROWS = 1_048_000  # safe threshold
+XLSX_BATCH_ROWS = 10_000  # rows materialized per column-wise batch
+# Formats that can be written straight from a LazyFrame with a streaming sink
+SINK_FORMATS = {"csv", "json"}
+# Same replacements as xml.sax.saxutils.escape, applied in Polars
+_XML_ESCAPE_FROM = ["&", "<", ">"]
+_XML_ESCAPE_TO = ["&amp;", "&lt;", "&gt;"]
+WRITE_BUFFER_SIZE = 1 << 20  # 1 MiB
+# Per-column cap on individually logged positional truncations
+TRUNCATION_WARNING_LIMIT = int(os.environ.get("ETL_TRUNCATION_WARNING_LIMIT", "100"))
 
 def ensure_parent(path: str):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ensure_dir(os.path.dirname(path))
 
-def write_csv(df: pl.DataFrame, path: str):
-    if not isinstance(df, pl.DataFrame):
-        raise WriterError("Input must be a Polars DataFrame")
+def _text_expr(name: str, dtype: pl.DataType) -> pl.Expr:
+    """Render a column as text the way str() renders its Python values (nulls stay null)."""
+    col = pl.col(name)
+    if dtype == pl.Boolean:
+        # No otherwise(): null booleans stay null instead of falling through to "False"
+        return pl.when(col).then(pl.lit("True")).when(~col).then(pl.lit("False"))
+    if dtype == pl.Datetime:
+        # str(datetime) only shows microseconds when they are non-zero
+        tz = "%:z" if getattr(dtype, "time_zone", None) else ""
+        return (
+            pl.when(col.dt.microsecond() == 0)
+            .then(col.dt.to_string(f"%Y-%m-%d %H:%M:%S{tz}"))
+            .otherwise(col.dt.to_string(f"%Y-%m-%d %H:%M:%S%.6f{tz}"))
+        )
+    if isinstance(dtype, (pl.List, pl.Array)):
+        # map_elements hands list cells over as Series; render them as the Python list str() saw
+        return col.map_elements(lambda s: str(s.to_list()), return_dtype=pl.Utf8)
+    if dtype.is_nested() or dtype in (pl.Binary, pl.Duration, pl.Object):
+        # No string cast for these; fall back to Python's rendering
+        return col.map_elements(str, return_dtype=pl.Utf8)
+    return col.cast(pl.Utf8)
+
+def _sink_or_collect(lf: pl.LazyFrame, sink, write):
+    """Stream a LazyFrame to disk, collecting first if the plan is not streamable."""
+    try:
+        sink(lf)
+    except pl.exceptions.InvalidOperationError:
+        write(lf.collect(streaming=True))
+
+def write_csv(df: Union[pl.DataFrame, pl.LazyFrame], path: str):
+    if not isinstance(df, (pl.DataFrame, pl.LazyFrame)):
+        raise WriterError("Input must be a Polars DataFrame or LazyFrame")
     if not path or not isinstance(path, str):
         raise WriterError("Path must be a non-empty string")
     
     ensure_parent(path)
     try:
-        df.write_csv(path)
+        if isinstance(df, pl.LazyFrame):
+            _sink_or_collect(df, lambda lf: lf.sink_csv(path), lambda out: out.write_csv(path))
+        else:
+            df.write_csv(path)
     except Exception as e:
         raise WriterError(f"Failed to write CSV: {e}") from e
 
-def write_ndjson(df: pl.DataFrame, path: str):
+def write_ndjson(df: Union[pl.DataFrame, pl.LazyFrame], path: str):
     ensure_parent(path)
     try:
-        df.write_ndjson(path)
+        if isinstance(df, pl.LazyFrame):
+            _sink_or_collect(df, lambda lf: lf.sink_ndjson(path), lambda out: out.write_ndjson(path))
+        else:
+            df.write_ndjson(path)
     except Exception as e:
         raise WriterError(f"Failed to write line-delimited JSON: {e}") from e
 
+def count_written_rows(path: str, fmt: str) -> int:
+    """Count the rows of a streamed output file without loading it."""
+    fmt = fmt.lower()
+    if fmt == "csv":
+        lf = pl.scan_csv(path)
+    elif fmt == "json":
+        lf = pl.scan_ndjson(path)
+    else:
+        raise WriterError(f"Cannot count rows for output_format: {fmt}")
+    return lf.select(pl.len()).collect().item()
+
+def _json_writable(dtype: pl.DataType) -> bool:
+    """Whether Polars' JSON writer can serialize this dtype (it panics on the others)."""
+    if dtype in (pl.Time, pl.Binary, pl.Duration, pl.Object):
+        return False
+    if dtype == pl.Datetime and dtype.time_zone:
+        return False
+    if isinstance(dtype, (pl.List, pl.Array)):
+        return _json_writable(dtype.inner)
+    if isinstance(dtype, pl.Struct):
+        return all(_json_writable(f.dtype) for f in dtype.fields)
+    return True
+
 def write_json(df: pl.DataFrame, path: str):
     """Write DataFrame as traditional JSON array format"""
     ensure_parent(path)
     try:
-        # Convert to list of dictionaries
-        data = df.to_dicts()
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False, default=str)
-    except Exception as e:
+        # Render temporal columns as ISO-8601 strings in Polars so every value is JSON-native
+        df = df.with_columns(
+            cs.date().dt.to_string("%Y-%m-%d"),
+            # Any time unit; zoned columns keep their UTC offset
+            cs.datetime(time_zone=None).dt.to_string("%Y-%m-%dT%H:%M:%S%.f"),
+            cs.datetime(time_zone="*").dt.to_string("%Y-%m-%dT%H:%M:%S%.f%:z"),
+        )
+        if all(_json_writable(dtype) for dtype in df.schema.values()):
+            # Row-oriented array serialized straight from the Arrow buffers
+            df.write_json(path)
+        else:
+            # Time/Binary/Duration/zoned values: serialize row dicts, stringifying what JSON can't hold
+            with open(path, "wb") as f:
+                f.write(orjson.dumps(df.to_dicts(), default=str))
+    # A Rust panic is a BaseException and would otherwise escape every handler above us
+    except (Exception, pl.exceptions.PanicException) as e:
         raise WriterError(f"Failed to write JSON array: {e}") from e
 
 def write_xlsx(df: pl.DataFrame, path: str):
@@ -50,9 +129,22 @@ def write_xlsx(df: pl.DataFrame, path: str):
     ensure_parent(path)
     try:
         total = df.height
-        wb = Workbook()
-        # Remove default sheet
-        wb.remove(wb.active)
+        # constant_memory flushes each row as it is written instead of holding every cell
+        # Keep URL-like strings as plain text (hyperlinks are capped per sheet and would drop cells)
+        # and write NaN/Inf as Excel errors instead of failing the whole file
+        wb = xlsxwriter.Workbook(path, {"constant_memory": True, "strings_to_urls": False, "nan_inf_to_errors": True})
+        # Temporal cells need a number format to display as dates/times; pick one per column dtype
+        temporal_fmts = {
+            pl.Date: wb.add_format({"num_format": "yyyy-mm-dd"}),
+            pl.Datetime: wb.add_format({"num_format": "yyyy-mm-dd h:mm:ss"}),
+            pl.Time: wb.add_format({"num_format": "h:mm:ss"}),
+            pl.Duration: wb.add_format({"num_format": "[h]:mm:ss"}),
+        }
+        col_fmts = [
+            next((fmt for base, fmt in temporal_fmts.items() if dtype == base), None)
+            for dtype in df.schema.values()
+        ]
+        has_temporal = any(fmt is not None for fmt in col_fmts)
         
         start = 0
         sheet_idx = 1
@@ -61,38 +153,43 @@ def write_xlsx(df: pl.DataFrame, path: str):
             chunk = df.slice(start, end - start)
             
             # Create new sheet
-            ws = wb.create_sheet(f"Sheet{sheet_idx}")
+            ws = wb.add_worksheet(f"Sheet{sheet_idx}")
             
-            # Write headers
-            for col_idx, col_name in enumerate(chunk.columns, 1):
-                ws.cell(row=1, column=col_idx, value=col_name)
-            
-            # Write data
-            for row_idx, row in enumerate(chunk.iter_rows(named=True), 2):
-                for col_idx, col_name in enumerate(chunk.columns, 1):
-                    value = row[col_name]
-                    ws.cell(row=row_idx, column=col_idx, value=value)
+            # Write headers, then rows rebuilt from per-column lists, one batch at a time
+            ws.write_row(0, 0, chunk.columns)
+            row_idx = 1
+            for batch in chunk.iter_slices(XLSX_BATCH_ROWS):
+                for row in zip(*(s.to_list() for s in batch.get_columns())):
+                    if has_temporal:
+                        for col_idx, value in enumerate(row):
+                            ws.write(row_idx, col_idx, value, col_fmts[col_idx])
+                    else:
+                        ws.write_row(row_idx, 0, row)
+                    row_idx += 1
             
             start = end
             sheet_idx += 1
         
-        wb.save(path)
+        wb.close()
     except Exception as e:
         raise WriterError(f"Failed to write XLSX: {e}") from e
 
 def write_xml(df: pl.DataFrame, path: str, root_tag: str = "records", row_tag: str = "record"):
     ensure_parent(path)
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(f"<{root_tag}>\n")
-            cols = df.columns
-            for row in df.iter_rows(named=True):
-                f.write(f"  <{row_tag}>")
-                for c in cols:
-                    v = "" if row[c] is None else str(row[c])
-                    f.write(f"<{c}>{escape(v)}</{c}>")
-                f.write(f"</{row_tag}>\n")
-            f.write(f"</{root_tag}>\n")
+        # Build every row's markup in a single Polars expression instead of per-cell Python calls
+        parts = [pl.lit(f"  <{row_tag}>")]
+        for c, dtype in df.schema.items():
+            value = _text_expr(c, dtype).fill_null("").str.replace_many(_XML_ESCAPE_FROM, _XML_ESCAPE_TO)
+            parts.extend((pl.lit(f"<{c}>"), value, pl.lit(f"</{c}>")))
+        parts.append(pl.lit(f"</{row_tag}>"))
+        # Large buffer so Polars' chunked writes and the wrapper tags coalesce into few syscalls
+        with open(path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+            f.write(f"<{root_tag}>\n".encode("utf-8"))
+            if df.height:
+                body = df.select(pl.concat_str(parts).alias("xml"))
+                body.write_csv(f, include_header=False, quote_style="never")
+            f.write(f"</{root_tag}>\n".encode("utf-8"))
     except Exception as e:
         raise WriterError(f"Failed to write XML: {e}") from e
 
@@ -101,55 +198,89 @@ def write_positional(df: pl.DataFrame, path: str, mappings: List[Dict[str, Any]]
     targets = [m["target"] for m in mappings if "target" in m]
     lengths = [m.get("length") for m in mappings if "target" in m]
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            for ridx, row in enumerate(df.iter_rows(named=True)):
-                pieces = []
-                for t, L in zip(targets, lengths):
-                    val = row.get(t, "")
-                    s = "" if val is None else str(val)
-                    width = int(L) if L is not None else len(s)
-                    if width < len(s):
-                        if logger:
-                            logger.warning(f"Truncating column '{t}' at row {ridx}: '{s}' -> width {width}")
-                        s = s[:width]
-                    # right-align numeric
-                    try:
-                        float(s)
-                        aligned = s.rjust(width)
-                    except:
-                        aligned = s.ljust(width)
-                    pieces.append(aligned)
-                f.write("".join(pieces) + "\n")
+        schema = df.schema
+        # Alignment is classified once per column from the dtype: right-align numeric, left-align the rest
+        numeric_cols = {c for c, dtype in schema.items() if dtype.is_numeric()}
+        # Render each referenced column to text once; line building and truncation checks share it
+        present = list(dict.fromkeys(t for t in targets if t in schema))
+        text = df.select([_text_expr(t, schema[t]).fill_null("").alias(t) for t in present]) if present else df
+        fields = []
+        fixed = []
+        for t, L in zip(targets, lengths):
+            # Missing columns are written as blanks, like a missing row key
+            s = pl.col(t) if t in schema else pl.lit("")
+            if L is None:
+                fields.append(s)
+                continue
+            width = int(L)
+            if t in schema:
+                fixed.append((t, width))
+            s = s.str.slice(0, width)
+            fields.append(s.str.pad_start(width) if t in numeric_cols else s.str.pad_end(width))
+
+        if logger and fixed:
+            _warn_truncations(text, fixed, logger)
+
+        # with_columns broadcasts literal-only lines to the frame height
+        line = pl.concat_str(fields or [pl.lit("")]).alias("__line__")
+        lines = text.with_columns(line).select("__line__")
+        lines.write_csv(path, include_header=False, quote_style="never")
     except Exception as e:
         raise WriterError(f"Failed to write positional: {e}") from e
 
-def write_output(df: pl.DataFrame, base_path: str, fmt: str, mappings: List[Dict[str, Any]], xml_cfg: Optional[Dict[str, Any]] = None, logger: Optional[Any] = None) -> str:
-    fmt = fmt.lower()
-    if fmt == "csv":
-        out_path = f"{base_path}.csv"
-        write_csv(df, out_path)
-        return out_path
-    if fmt == "json":
-        out_path = f"{base_path}.jsonl"
-        write_ndjson(df, out_path)
-        return out_path
-    if fmt == "json_array":
-        out_path = f"{base_path}.json"
-        write_json(df, out_path)
-        return out_path
-    if fmt == "xlsx":
-        out_path = f"{base_path}.xlsx"
-        write_xlsx(df, out_path)
-        return out_path
-    if fmt == "xml":
-        out_path = f"{base_path}.xml"
-        root_tag = (xml_cfg or {}).get("root_tag", "records")
-        row_tag = (xml_cfg or {}).get("row_tag", "record")
-        write_xml(df, out_path, root_tag, row_tag)
-        return out_path
-    if fmt == "positional":
-        out_path = f"{base_path}.txt"
-        write_positional(df, out_path, mappings, logger=logger)
-        return out_path
-    raise WriterError(f"Unsupported output_format: {fmt}")
+def _warn_truncations(text: pl.DataFrame, fixed: List[tuple], logger: Any):
+    """Log values that will be cut to their positional width, using one mask per column.
 
+    text holds the already rendered string columns. At most TRUNCATION_WARNING_LIMIT
+    rows are logged per column, followed by a count.
+    """
+    too_long = text.select([(pl.col(t).str.len_chars() > width).sum().alias(t) for t, width in fixed])
+    for t, width in fixed:
+        count = too_long[t][0]
+        if not count:
+            continue
+        rows = (
+            text.lazy()
+            .select(t)
+            .with_row_index("__row__")
+            .filter(pl.col(t).str.len_chars() > width)
+            .head(TRUNCATION_WARNING_LIMIT)
+            .collect()
+        )
+        for ridx, s in rows.iter_rows():
+            logger.warning(f"Truncating column '{t}' at row {ridx}: '{s}' -> width {width}")
+        if count > TRUNCATION_WARNING_LIMIT:
+            logger.warning(f"Truncated {count:,} values in column '{t}' to width {width} ({count - TRUNCATION_WARNING_LIMIT:,} not shown)")
+
+def _write_xml_output(df, path, mappings, xml_cfg, logger):
+    root_tag = (xml_cfg or {}).get("root_tag", "records")
+    row_tag = (xml_cfg or {}).get("row_tag", "record")
+    write_xml(df, path, root_tag, row_tag)
+
+# output_format -> (file extension, writer(df, path, mappings, xml_cfg, logger))
+_WRITERS: Dict[str, Tuple[str, Callable[..., None]]] = {
+    "csv": (".csv", lambda df, path, mappings, xml_cfg, logger: write_csv(df, path)),
+    "json": (".jsonl", lambda df, path, mappings, xml_cfg, logger: write_ndjson(df, path)),
+    "json_array": (".json", lambda df, path, mappings, xml_cfg, logger: write_json(df, path)),
+    "xlsx": (".xlsx", lambda df, path, mappings, xml_cfg, logger: write_xlsx(df, path)),
+    "xml": (".xml", _write_xml_output),
+    "positional": (".txt", lambda df, path, mappings, xml_cfg, logger: write_positional(df, path, mappings, logger=logger)),
+}
+
+def write_output(df: Union[pl.DataFrame, pl.LazyFrame], base_path: str, fmt: str, mappings: List[Dict[str, Any]], xml_cfg: Optional[Dict[str, Any]] = None, logger: Optional[Any] = None) -> str:
+    fmt = fmt.lower()
+    writer = _WRITERS.get(fmt)
+    if writer is None:
+        raise WriterError(f"Unsupported output_format: {fmt}")
+    ext, write = writer
+    out_path = f"{base_path}{ext}"
+    try:
+        write(df, out_path, mappings, xml_cfg, logger)
+    except WriterError:
+        # The cached output directory may have been removed since it was created; recreate and retry once
+        parent = os.path.dirname(out_path)
+        if not parent or os.path.isdir(parent):
+            raise
+        forget_dir(parent)
+        write(df, out_path, mappings, xml_cfg, logger)
+    return out_path